@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from settings import ACCOUNTING_PATH, FILE_PATH
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# interval between two collection cycles (see cron.py)
+SAMPLE_INTERVAL = timedelta(minutes=15)
+# longer gaps (collector down) are not billed past this
+MAX_INTERVAL = 2 * SAMPLE_INTERVAL
+# same threshold as the dashboard's "inactive" GPUs
+IDLE_THRESHOLD = 1
+# cycle timestamps are kept a bit longer than the raw store's 14 days
+CYCLES_RETENTION = timedelta(days=15)
+
+KEYS = ["username", "gpu_name", "date"]
+COUNTERS = ["gpu_hours", "idle_gpu_hours", "mem_util_hours", "samples"]
+
+
+def empty_counters() -> pd.DataFrame:
+    return pd.DataFrame(columns=KEYS + COUNTERS)
+
+
+def load_state(path=ACCOUNTING_PATH) -> dict:
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"last_timestamp": None, "cycles": [], "counters": []}
+
+
+def save_state(state, path=ACCOUNTING_PATH):
+    # write then rename so a crash never leaves a truncated checkpoint
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(state, file, indent=4)
+    os.replace(tmp_path, path)
+
+
+def previous_timestamps(timestamps, last_timestamp=None) -> dict:
+    """Map each collection timestamp to the one of the cycle before it."""
+    timestamps = sorted(set(timestamps))
+    return dict(zip(timestamps, [last_timestamp] + timestamps[:-1]))
+
+
+def integrate(samples: list[dict], previous: dict) -> pd.DataFrame:
+    """
+    Turn raw samples into per-user/per-model/per-day counters.
+
+    Each sample is billed for the time since the previous cycle, so a pod
+    stops being billed once it disappears from the samples. A pod that
+    started after the previous cycle is only billed from its start time.
+    """
+    if len(samples) == 0:
+        return empty_counters()
+
+    df = pd.DataFrame(samples)
+    if "start_time" not in df:
+        df["start_time"] = None
+    df = df.explode("gpu_usage").dropna(subset=["gpu_usage"])
+    if len(df) == 0:
+        return empty_counters()
+    usage = pd.DataFrame(df["gpu_usage"].tolist(), index=df.index)
+    df = pd.concat([df.drop(columns="gpu_usage"), usage], axis=1)
+
+    timestamp = pd.to_datetime(df["timestamp"], format=TIMESTAMP_FORMAT)
+    start = pd.to_datetime(df["timestamp"].map(previous), format=TIMESTAMP_FORMAT)
+    start = start.fillna(timestamp - SAMPLE_INTERVAL)
+    start_time = pd.to_datetime(df["start_time"], format=TIMESTAMP_FORMAT)
+    start = start.mask(start_time > start, start_time)
+
+    hours = (timestamp - start).clip(lower=timedelta(0), upper=MAX_INTERVAL)
+    df["gpu_hours"] = hours.dt.total_seconds() / 3600
+    gpu_mem_used = df["memory_used"] / df["memory_total"] * 100
+    df["idle_gpu_hours"] = df["gpu_hours"].where(gpu_mem_used < IDLE_THRESHOLD, 0)
+    df["mem_util_hours"] = gpu_mem_used * df["gpu_hours"]
+    df["samples"] = 1
+    df["date"] = timestamp.dt.strftime("%Y-%m-%d")
+
+    return df.groupby(KEYS)[COUNTERS].sum().reset_index()
+
+
+def average_mem_util(counters: pd.DataFrame) -> pd.Series:
+    gpu_hours = counters["gpu_hours"].astype(float)
+    mem_util = counters["mem_util_hours"].astype(float) / gpu_hours.where(gpu_hours > 0)
+    return mem_util.fillna(0)
+
+
+def merge_counters(*counters: pd.DataFrame) -> pd.DataFrame:
+    counters = [c for c in counters if len(c) > 0]
+    if len(counters) == 0:
+        return empty_counters()
+    return pd.concat(counters).groupby(KEYS)[COUNTERS].sum().reset_index()
+
+
+def update(samples: list[dict], timestamp: str, path=ACCOUNTING_PATH) -> dict:
+    """
+    Add one collection cycle to the checkpointed counters.
+
+    `timestamp` is the cycle's timestamp, passed separately so that cycles
+    without any GPU pod still advance the checkpoint. It is also recorded in
+    the checkpoint so that `backfill` bills the same intervals.
+    """
+    state = load_state(path)
+    last_timestamp = state["last_timestamp"]
+    if last_timestamp is not None and timestamp <= last_timestamp:
+        # cycle already accounted for
+        return state
+
+    previous = previous_timestamps([timestamp], last_timestamp)
+    counters = merge_counters(
+        pd.DataFrame(state["counters"], columns=KEYS + COUNTERS),
+        integrate(samples, previous),
+    )
+    cutoff = datetime.strptime(timestamp, TIMESTAMP_FORMAT) - CYCLES_RETENTION
+    cycles = [
+        cycle
+        for cycle in state.get("cycles", [])
+        if cycle >= cutoff.strftime(TIMESTAMP_FORMAT)
+    ]
+    state = {
+        "last_timestamp": timestamp,
+        "cycles": cycles + [timestamp],
+        "counters": counters.to_dict("records"),
+    }
+    save_state(state, path)
+    return state
+
+
+def chunk_by_day(samples: list[dict], days: int) -> list[list[dict]]:
+    chunks = {}
+    for sample in samples:
+        day = datetime.strptime(sample["timestamp"], TIMESTAMP_FORMAT).toordinal()
+        chunks.setdefault(day // days, []).append(sample)
+    return [chunks[k] for k in sorted(chunks)]
+
+
+def backfill(
+    store_path=FILE_PATH, path=ACCOUNTING_PATH, workers=None, chunk_days=1
+) -> dict:
+    """
+    Rebuild the counters of the days covered by the raw store.
+
+    The store only keeps 14 days of samples, so counters of earlier days are
+    kept as they are. Its first day is usually cut by the retention, so it is
+    only rebuilt when the checkpoint has no counters for it yet.
+
+    Cycles without any GPU pod are not in the store, so intervals are taken
+    from the cycles recorded by `update` and match its counters exactly.
+    """
+    with open(store_path, "r") as file:
+        samples = json.load(file)
+    state = load_state(path)
+    if len(samples) == 0:
+        return state
+
+    existing = pd.DataFrame(state["counters"], columns=KEYS + COUNTERS)
+    first_day = min(sample["timestamp"] for sample in samples)[:10]
+    rebuild_from = first_day
+    if (existing["date"] == first_day).any():
+        rebuild_from = (
+            datetime.strptime(first_day, "%Y-%m-%d") + timedelta(days=1)
+        ).strftime("%Y-%m-%d")
+    kept = existing[existing["date"] < rebuild_from]
+
+    # computed over all cycles so that chunks can be integrated independently
+    cycles = state.get("cycles", []) + [sample["timestamp"] for sample in samples]
+    if state["last_timestamp"] is not None:
+        cycles.append(state["last_timestamp"])
+    previous = previous_timestamps(cycles)
+    samples = [sample for sample in samples if sample["timestamp"] >= rebuild_from]
+    chunks = chunk_by_day(samples, chunk_days)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parts = list(executor.map(integrate, chunks, [previous] * len(chunks)))
+
+    counters = merge_counters(kept, *parts)
+    state = {
+        "last_timestamp": max(previous, default=None),
+        "cycles": sorted(previous),
+        "counters": counters.to_dict("records"),
+    }
+    save_state(state, path)
+    return state
+
+
+def export(output, fmt=None, path=ACCOUNTING_PATH, since=None):
+    counters = pd.DataFrame(load_state(path)["counters"], columns=KEYS + COUNTERS)
+    if since is not None:
+        counters = counters[counters["date"] >= since].copy()
+    counters["avg_mem_util"] = average_mem_util(counters)
+    counters = counters.drop(columns="mem_util_hours")
+
+    fmt = fmt or os.path.splitext(output)[1].lstrip(".")
+    if fmt == "csv":
+        counters.to_csv(output, index=False)
+    elif fmt == "parquet":
+        counters.to_parquet(output, index=False)
+    else:
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPU-hours accounting")
+    parser.add_argument("--state", default=ACCOUNTING_PATH, help="checkpoint file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="export the counters")
+    export_parser.add_argument("output", help="output .csv or .parquet file")
+    export_parser.add_argument("--format", choices=["csv", "parquet"])
+    export_parser.add_argument("--since", help="first day to export (YYYY-MM-DD)")
+
+    backfill_parser = subparsers.add_parser(
+        "backfill", help="rebuild the counters from the raw store"
+    )
+    backfill_parser.add_argument("--store", default=FILE_PATH)
+    backfill_parser.add_argument("--workers", type=int, default=None)
+    backfill_parser.add_argument("--chunk-days", type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export(args.output, fmt=args.format, path=args.state, since=args.since)
+    elif args.command == "backfill":
+        state = backfill(
+            store_path=args.store,
+            path=args.state,
+            workers=args.workers,
+            chunk_days=args.chunk_days,
+        )
+        print(
+            f"Rebuilt {len(state['counters'])} counters up to {state['last_timestamp']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 
-from utils import filter_while_true_pods, get_pending_pods
-
-FILE_PATH = "/nfs/user/s2234411-infk8s/cluster_gpu_usage.json"
-
+from accounting import COUNTERS, KEYS, average_mem_util, load_state
+from collector import load_nodes, load_targets, new_api_client
+from settings import DEFAULT_TARGET, FILE_PATH
+from utils import get_pending_pods
 
 st.button("Refresh")
 
@@ -20,6 +22,11 @@ Active GPUs are those with memory usage greater than 1% in the last hour.
 
 def get_data() -> pd.DataFrame:
     df = pd.read_json(FILE_PATH)
+    # samples collected before multi-target collection are untagged
+    for column in ["cluster", "namespace"]:
+        if column not in df:
+            df[column] = DEFAULT_TARGET[column]
+        df[column] = df[column].fillna(DEFAULT_TARGET[column])
 
     def add_gpu_id(gpu_usage):
         new_list = []
@@ -28,12 +35,10 @@ def get_data() -> pd.DataFrame:
             new_list.append(g)
         return new_list
 
-    interactive_pods = filter_while_true_pods()
-    is_interactive = set()
-    for pod in interactive_pods:
-        is_interactive.add(pod["name"])
-
-    df["is_interactive"] = df["pod_name"].isin(is_interactive)
+    # classified by the collector, missing from samples collected before that
+    if "is_interactive" not in df:
+        df["is_interactive"] = False
+    df["is_interactive"] = df["is_interactive"].fillna(False).astype(bool)
 
     df["gpu_usage"] = df["gpu_usage"].apply(add_gpu_id)
     df = df.explode("gpu_usage")
@@ -55,15 +60,18 @@ def get_colors(df: pd.DataFrame) -> dict:
 df = get_data()
 color_map = get_colors(df)
 
+# pod names are only unique within a namespace
+POD_KEYS = ["cluster", "namespace", "pod_name"]
+
 # plot current usage, stacked bar chart per user
 latest_timestamp = df["timestamp"].max()
 current_df = df[df["timestamp"] == latest_timestamp].copy()
 last_hour_df = df[
     (df["timestamp"] > latest_timestamp - pd.Timedelta(hours=1))
-    & (df["pod_name"].isin(current_df["pod_name"].unique()))
+    & (df["pod_id"].isin(current_df["pod_id"].unique()))
 ]
 last_hour_df = (
-    last_hour_df.groupby(["pod_name", "gpu_id"])
+    last_hour_df.groupby(POD_KEYS + ["gpu_id"])
     .agg(
         {
             "memory_free": "mean",
@@ -78,10 +86,10 @@ last_hour_df = (
 
 last_day_df = df[
     (df["timestamp"] > latest_timestamp - pd.Timedelta(days=1))
-    & (df["pod_name"].isin(current_df["pod_name"].unique()))
+    & (df["pod_id"].isin(current_df["pod_id"].unique()))
 ]
 last_day_df = (
-    last_day_df.groupby(["pod_name", "gpu_id"])
+    last_day_df.groupby(POD_KEYS + ["gpu_id"])
     .agg(
         {
             "username": "first",
@@ -103,7 +111,32 @@ last_day_df["memory_requested"] = last_day_df["memory_requested"].astype(int)
 # show current global counts
 gpu_counts = current_df.gpu_name.value_counts()
 
-pending_pods = get_pending_pods()
+
+@st.cache_resource
+def get_api_client(kubeconfig, context):
+    return new_api_client({"kubeconfig": kubeconfig, "context": context})
+
+
+def get_target_pending_pods(target: dict) -> tuple[list[str], Exception | None]:
+    # errors are returned, st.warning can't be called from the executor threads
+    try:
+        api_client = get_api_client(target["kubeconfig"], target["context"])
+        return get_pending_pods(target["namespace"], api_client), None
+    except Exception as e:
+        return [], e
+
+
+targets = load_targets()
+pending_pods = []
+with ThreadPoolExecutor() as executor:
+    results = executor.map(get_target_pending_pods, targets)
+    for target, (target_pods, error) in zip(targets, results):
+        if error is not None:
+            st.warning(
+                f"Could not list pending pods in {target['namespace']} "
+                f"on {target['cluster']}: {error}"
+            )
+        pending_pods += target_pods
 gpu_counts["Pending"] = len(pending_pods)
 
 cols = st.columns(len(gpu_counts) + 1)
@@ -152,13 +185,13 @@ for col, count_inactive, time_period in zip(
 
 
 count_inactive_pods_last_hour = (
-    last_hour_df.groupby("pod_name")
+    last_hour_df.groupby(POD_KEYS)
     .agg({"inactive": "all"})
     .reset_index()["inactive"]
     .sum()
 )
 count_inactive_pods_last_day = (
-    last_day_df.groupby("pod_name")
+    last_day_df.groupby(POD_KEYS)
     .agg({"inactive": "all"})
     .reset_index()["inactive"]
     .sum()
@@ -283,13 +316,17 @@ fig = px.bar(
 st.plotly_chart(fig, use_container_width=True)
 
 
-# plot average utilization rates
+# plot average utilization rates, from the accounting counters
+counters_df = pd.DataFrame(load_state()["counters"], columns=KEYS + COUNTERS)
 avg_usage_df = (
-    df.groupby(["username", "gpu_name"]).agg({"gpu_mem_used": "mean"}).reset_index()
+    counters_df.groupby(["username", "gpu_name"])
+    .agg({"gpu_hours": "sum", "idle_gpu_hours": "sum", "mem_util_hours": "sum"})
+    .reset_index()
 )
-sorted_df = last_hour_usage_df.sort_values(by="gpu_mem_used", ascending=False)
+avg_usage_df["gpu_mem_used"] = average_mem_util(avg_usage_df)
+sorted_df = avg_usage_df.sort_values(by="gpu_mem_used", ascending=False)
 fig = px.bar(
-    last_hour_usage_df,
+    avg_usage_df,
     x="username",
     y="gpu_mem_used",
     color="gpu_name",
@@ -301,6 +338,26 @@ fig = px.bar(
 )
 st.plotly_chart(fig, use_container_width=True)
 
+# plot GPU-hours per user
+sorted_df = (
+    avg_usage_df.groupby("username")["gpu_hours"].sum().sort_values(ascending=False)
+)
+fig = px.bar(
+    avg_usage_df.melt(
+        id_vars=["username", "gpu_name"],
+        value_vars=["gpu_hours", "idle_gpu_hours"],
+    ),
+    x="username",
+    y="value",
+    color="gpu_name",
+    facet_row="variable",
+    title="GPU-hours per user",
+    color_discrete_map=color_map,
+    category_orders={"username": sorted_df.index.tolist()},
+    labels={"value": "GPU-hours"},
+)
+st.plotly_chart(fig, use_container_width=True)
+
 
 # plot GPU usage over time per user
 gpu_usage_df = (
@@ -331,31 +388,33 @@ st.markdown("""
 ### Current Node Usage
 """)
 
-MAX_CPU_COUNT = 192
-MAX_MEMORY_COUNT = 890
-MAX_GPU_COUNT = 8
-
 nodes_df = (
-    current_df.groupby(["node_name", "pod_name"])
+    current_df.groupby(["cluster", "node_name", "namespace", "pod_name"])
     .agg({"cpu_requested": "first", "memory_requested": "first", "gpu_name": "count"})
     .reset_index()
 )
 nodes_df = (
-    nodes_df.groupby("node_name")
+    nodes_df.groupby(["cluster", "node_name"])
     .agg({"cpu_requested": "sum", "memory_requested": "sum", "gpu_name": "sum"})
     .reset_index()
 )
+# node capacities come from the allocatable cached by the collector
+capacity_df = pd.DataFrame(
+    load_nodes(), columns=["cluster", "node_name", "cpu", "memory", "gpu"]
+)
+nodes_df = nodes_df.merge(capacity_df, on=["cluster", "node_name"], how="left")
 nodes_df["cpu_requested"] = (
-    (nodes_df["cpu_requested"].astype(int) / MAX_CPU_COUNT) * 100
+    (nodes_df["cpu_requested"].astype(int) / nodes_df["cpu"]) * 100
 ).round(2)
 nodes_df["memory_requested"] = (
-    (nodes_df["memory_requested"].astype(int) / MAX_MEMORY_COUNT) * 100
+    (nodes_df["memory_requested"].astype(int) / nodes_df["memory"]) * 100
 ).round(2)
-nodes_df["gpu_name"] = ((nodes_df["gpu_name"].astype(int) / MAX_GPU_COUNT) * 100).round(
-    2
-)
+nodes_df["gpu_name"] = (
+    (nodes_df["gpu_name"].astype(int) / nodes_df["gpu"]) * 100
+).round(2)
+nodes_df = nodes_df.drop(columns=["cpu", "memory", "gpu"])
 # rename columns
-nodes_df.sort_values("node_name", ascending=True, inplace=True)
+nodes_df.sort_values(["cluster", "node_name"], ascending=True, inplace=True)
 nodes_df = nodes_df.rename(
     columns={
         "cpu_requested": "CPU usage (%)",
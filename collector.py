@@ -0,0 +1,165 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from kubernetes import config
+
+from settings import (
+    COLLECTOR_CONCURRENCY,
+    COLLECTOR_WORKERS,
+    DEFAULT_TARGET,
+    NODES_PATH,
+    TARGETS_PATH,
+)
+from utils import (
+    get_gpu_usage_in_pod_threaded,
+    get_nodes_allocatable,
+    get_pod_stats,
+    list_gpu_pods,
+)
+
+
+def load_targets(path=TARGETS_PATH) -> list[dict]:
+    if path is None:
+        return [dict(DEFAULT_TARGET)]
+    with open(path, "r") as file:
+        targets = [{**DEFAULT_TARGET, "cluster": None, **t} for t in json.load(file)]
+
+    clusters = {}
+    for target in targets:
+        # name clusters after their context, or their kubeconfig, unless told otherwise
+        if target["cluster"] is None:
+            if target["context"] is not None:
+                target["cluster"] = target["context"]
+            elif target["kubeconfig"] == DEFAULT_TARGET["kubeconfig"]:
+                target["cluster"] = DEFAULT_TARGET["cluster"]
+            else:
+                target["cluster"] = target["kubeconfig"]
+        cluster = clusters.setdefault(target["cluster"], client_key(target))
+        if cluster != client_key(target):
+            raise ValueError(
+                f"Cluster {target['cluster']} is used by both {cluster} and "
+                f"{client_key(target)}"
+            )
+    return targets
+
+
+def client_key(target: dict) -> tuple:
+    return target["kubeconfig"], target["context"]
+
+
+def new_api_client(target: dict):
+    return config.new_client_from_config(
+        config_file=target["kubeconfig"], context=target["context"]
+    )
+
+
+def collect_shard(
+    targets: list[dict], known_interactive=None, concurrency=COLLECTOR_CONCURRENCY
+):
+    """
+    Collect a list of targets from a worker process.
+
+    The pods of every target are listed first, with one client per cluster,
+    then the execs of all targets are queued on one pool of `concurrency`
+    threads, each thread with its own client. A target that fails is skipped.
+    """
+    api_clients, data, nodes, pending = {}, [], [], []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for target in targets:
+            cluster = target["cluster"]
+            try:
+                if client_key(target) not in api_clients:
+                    api_clients[client_key(target)] = new_api_client(target)
+            except Exception as e:
+                print(f"Error connecting to {cluster}: {e}")
+                continue
+            api_client = api_clients[client_key(target)]
+
+            if target["collect_nodes"]:
+                try:
+                    for node in get_nodes_allocatable(api_client):
+                        nodes.append({"cluster": cluster, **node})
+                except Exception as e:
+                    print(f"Error listing nodes on {cluster}: {e}")
+
+            try:
+                pods = list_gpu_pods(target["namespace"], api_client)
+            except Exception as e:
+                print(f"Error collecting {target['namespace']} on {cluster}: {e}")
+                continue
+            for pod in pods:
+                future = executor.submit(
+                    get_gpu_usage_in_pod_threaded,
+                    pod.metadata.name,
+                    target["namespace"],
+                    api_client.configuration,
+                )
+                pending.append((target, pod, future))
+
+        for target, pod, future in pending:
+            try:
+                entry = get_pod_stats(pod, future.result(), known_interactive)
+            except Exception as e:
+                print(f"Error collecting pod {pod.metadata.name}: {e}")
+                continue
+            if entry is None:
+                continue
+            entry["cluster"] = target["cluster"]
+            entry["namespace"] = target["namespace"]
+            data.append(entry)
+    return data, nodes
+
+
+def shard_targets(targets: list[dict], num_shards: int) -> list[list[dict]]:
+    shards = [targets[i::num_shards] for i in range(num_shards)]
+    return [shard for shard in shards if shard]
+
+
+def collect(
+    targets: list[dict], known_interactive=None, workers=COLLECTOR_WORKERS
+) -> list[dict]:
+    """
+    Collect all targets across worker processes and refresh the node cache.
+
+    `known_interactive` maps pod uids to their interactive flag, so that
+    pods are only classified once in their lifetime.
+    """
+    if len(targets) == 0:
+        return []
+
+    # list each cluster's nodes from one shard only
+    seen_clusters = set()
+    for target in targets:
+        target["collect_nodes"] = target["cluster"] not in seen_clusters
+        seen_clusters.add(target["cluster"])
+
+    shards = shard_targets(targets, min(workers, len(targets)))
+    with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+        results = list(
+            executor.map(collect_shard, shards, [known_interactive] * len(shards))
+        )
+
+    data = [entry for shard_data, _ in results for entry in shard_data]
+    nodes = [node for _, shard_nodes in results for node in shard_nodes]
+    # keep the cached nodes of clusters that could not be listed this time
+    refreshed = {node["cluster"] for node in nodes}
+    nodes += [node for node in load_nodes() if node["cluster"] not in refreshed]
+    save_nodes(nodes)
+    return data
+
+
+def load_nodes(path=NODES_PATH) -> list[dict]:
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return []
+
+
+def save_nodes(nodes, path=NODES_PATH):
+    # write then rename so the dashboard never reads a partial file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(nodes, file, indent=4)
+    os.replace(tmp_path, path)
@@ -2,9 +2,9 @@ import json
 import time
 from datetime import datetime, timedelta
 
-from utils import get_pods_not_using_gpus_stats
-
-FILE_PATH = "/nfs/user/s2234411-infk8s/cluster_gpu_usage.json"
+from accounting import update as update_accounting
+from collector import collect, load_targets
+from settings import FILE_PATH
 
 
 def load_data():
@@ -21,13 +21,20 @@ def save_data(data):
 
 
 def main():
-    new_data_list = get_pods_not_using_gpus_stats()
+    existing_data = load_data()
+    # pods are classified once, the first time they are collected
+    known_interactive = {
+        entry["pod_id"]: entry["is_interactive"]
+        for entry in existing_data
+        if "is_interactive" in entry
+    }
+
+    new_data_list = collect(load_targets(), known_interactive)
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     for data in new_data_list:
         data["timestamp"] = timestamp
 
-    existing_data = load_data()
     # Append the new data
     existing_data.extend(new_data_list)
 
@@ -40,6 +47,7 @@ def main():
     ]
 
     save_data(filtered_data)
+    update_accounting(new_data_list, timestamp)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,31 @@
+import json
+import os
+
+DATA_DIR = os.environ.get("EIDF_MONITOR_DATA_DIR", "/nfs/user/s2234411-infk8s")
+
+# raw samples written by cron.py and read by the dashboard
+FILE_PATH = os.path.join(DATA_DIR, "cluster_gpu_usage.json")
+# node allocatable cache, refreshed by every collection cycle
+NODES_PATH = os.path.join(DATA_DIR, "cluster_nodes.json")
+# GPU-hours accounting checkpoint
+ACCOUNTING_PATH = os.path.join(DATA_DIR, "cluster_gpu_accounting.json")
+
+# JSON list of {"kubeconfig", "context", "namespace", "cluster"} to collect from
+TARGETS_PATH = os.environ.get("EIDF_MONITOR_TARGETS")
+DEFAULT_TARGET = {
+    "kubeconfig": "/kubernetes/config",
+    "context": None,
+    "namespace": "informatics",
+    "cluster": "eidf",
+}
+
+# number of collector processes, and concurrent pod execs within each of them
+COLLECTOR_WORKERS = int(os.environ.get("EIDF_MONITOR_WORKERS", 4))
+COLLECTOR_CONCURRENCY = int(os.environ.get("EIDF_MONITOR_CONCURRENCY", 8))
+
+# regexes matched against pod commands to tag interactive (idle-by-design) pods
+INTERACTIVE_PATTERNS = json.loads(
+    os.environ.get(
+        "EIDF_MONITOR_INTERACTIVE_PATTERNS", '["sleep infinity", "while true"]'
+    )
+)
@@ -0,0 +1,166 @@
+import json
+
+import pytest
+
+from accounting import backfill, load_state, save_state, update
+
+
+def make_sample(timestamp, memory_used, start_time=None, username="alice"):
+    return {
+        "username": username,
+        "pod_id": f"{username}-pod",
+        "start_time": start_time,
+        "timestamp": timestamp,
+        "gpu_usage": [
+            {"gpu_name": "A100", "memory_used": used, "memory_total": 100}
+            for used in memory_used
+        ],
+    }
+
+
+def run_cycles(cycles, path, store=None):
+    """Feed (timestamp, samples) cycles to `update`, optionally writing the store."""
+    samples = []
+    for timestamp, cycle_samples in cycles:
+        update(cycle_samples, timestamp, path)
+        samples.extend(cycle_samples)
+    if store is not None:
+        with open(store, "w") as file:
+            json.dump(samples, file)
+    return load_state(path)
+
+
+def hours(state, date, username="alice"):
+    for counter in state["counters"]:
+        if counter["username"] == username and counter["date"] == date:
+            return counter["gpu_hours"], counter["idle_gpu_hours"]
+    return 0, 0
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "accounting.json")
+
+
+def test_first_cycle_billed_one_sample_interval(path):
+    state = run_cycles(
+        [("2024-01-01 10:00:00", [make_sample("2024-01-01 10:00:00", [0, 50])])],
+        path,
+    )
+    assert hours(state, "2024-01-01") == pytest.approx((0.5, 0.25))
+
+
+def test_cycles_billed_since_previous_cycle(path):
+    state = run_cycles(
+        [
+            ("2024-01-01 10:00:00", [make_sample("2024-01-01 10:00:00", [0, 50])]),
+            ("2024-01-01 10:10:00", [make_sample("2024-01-01 10:10:00", [0, 50])]),
+        ],
+        path,
+    )
+    # 15 minutes then 10 minutes, on two GPUs of which one idle
+    assert hours(state, "2024-01-01") == pytest.approx((2 * 25 / 60, 25 / 60))
+
+
+def test_gap_clamped_to_max_interval(path):
+    state = run_cycles(
+        [
+            ("2024-01-01 10:00:00", [make_sample("2024-01-01 10:00:00", [50])]),
+            ("2024-01-01 12:00:00", [make_sample("2024-01-01 12:00:00", [50])]),
+        ],
+        path,
+    )
+    assert hours(state, "2024-01-01") == pytest.approx((0.25 + 0.5, 0))
+
+
+def test_pod_billed_from_its_start_time(path):
+    state = run_cycles(
+        [
+            ("2024-01-01 10:00:00", []),
+            (
+                "2024-01-01 10:15:00",
+                [make_sample("2024-01-01 10:15:00", [0], "2024-01-01 10:10:00")],
+            ),
+        ],
+        path,
+    )
+    assert hours(state, "2024-01-01") == pytest.approx((5 / 60, 5 / 60))
+
+
+def test_empty_cycle_advances_checkpoint(path):
+    state = run_cycles(
+        [
+            ("2024-01-01 10:00:00", [make_sample("2024-01-01 10:00:00", [50])]),
+            ("2024-01-01 10:15:00", []),
+            ("2024-01-01 10:30:00", [make_sample("2024-01-01 10:30:00", [50])]),
+        ],
+        path,
+    )
+    assert hours(state, "2024-01-01") == pytest.approx((0.5, 0))
+
+
+def test_cycle_accounted_once(path):
+    sample = make_sample("2024-01-01 10:00:00", [50])
+    run_cycles([("2024-01-01 10:00:00", [sample])], path)
+    state = run_cycles(
+        [("2024-01-01 10:00:00", [sample]), ("2024-01-01 09:45:00", [sample])],
+        path,
+    )
+    assert hours(state, "2024-01-01") == pytest.approx((0.25, 0))
+    assert state["last_timestamp"] == "2024-01-01 10:00:00"
+
+
+def test_backfill_matches_update(path, tmp_path):
+    store = str(tmp_path / "store.json")
+    state = run_cycles(
+        [
+            ("2024-01-01 23:45:00", [make_sample("2024-01-01 23:45:00", [0, 50])]),
+            ("2024-01-02 00:00:00", []),
+            ("2024-01-02 00:15:00", [make_sample("2024-01-02 00:15:00", [0, 50])]),
+            (
+                "2024-01-02 00:30:00",
+                [make_sample("2024-01-02 00:30:00", [0, 50], "2024-01-02 00:20:00")],
+            ),
+        ],
+        path,
+        store,
+    )
+    save_state({**state, "counters": []}, path)
+
+    rebuilt = backfill(store, path, workers=2)
+    for date in ["2024-01-01", "2024-01-02"]:
+        assert hours(rebuilt, date) == pytest.approx(hours(state, date))
+    assert hours(rebuilt, "2024-01-02") == pytest.approx((2 * 25 / 60, 25 / 60))
+    assert rebuilt["last_timestamp"] == state["last_timestamp"]
+
+
+def test_backfill_keeps_days_before_store(path, tmp_path):
+    store = str(tmp_path / "store.json")
+    counters = [
+        {
+            "username": "alice",
+            "gpu_name": "A100",
+            "date": date,
+            "gpu_hours": 10.0,
+            "idle_gpu_hours": 1.0,
+            "mem_util_hours": 100.0,
+            "samples": 40,
+        }
+        for date in ["2024-01-01", "2024-01-02"]
+    ]
+    save_state(
+        {"last_timestamp": "2024-01-02 23:45:00", "cycles": [], "counters": counters},
+        path,
+    )
+    samples = [
+        make_sample("2024-01-02 23:45:00", [50]),
+        make_sample("2024-01-03 00:00:00", [0]),
+    ]
+    with open(store, "w") as file:
+        json.dump(samples, file)
+
+    state = backfill(store, path, workers=2)
+    # the store's first day is only partly retained, its counters are kept
+    assert hours(state, "2024-01-01") == pytest.approx((10, 1))
+    assert hours(state, "2024-01-02") == pytest.approx((10, 1))
+    assert hours(state, "2024-01-03") == pytest.approx((0.25, 0.25))
@@ -1,9 +1,47 @@
 import subprocess
 import json
+import re
+import threading
 from datetime import datetime
 from kubernetes import client, config
 from kubernetes.stream import stream
 
+from settings import INTERACTIVE_PATTERNS
+
+# compiled separately so that an empty list matches nothing
+INTERACTIVE_REGEXES = [re.compile(pattern) for pattern in INTERACTIVE_PATTERNS]
+
+# `stream` swaps the client's request method during an exec, so concurrent
+# execs each need their own client
+_exec_api_clients = threading.local()
+
+
+def get_exec_api_client(configuration) -> client.ApiClient:
+    api_clients = _exec_api_clients.__dict__.setdefault("api_clients", {})
+    if configuration not in api_clients:
+        api_clients[configuration] = client.ApiClient(configuration)
+    return api_clients[configuration]
+
+
+def is_interactive_command(command: str) -> bool:
+    return any(regex.search(command) for regex in INTERACTIVE_REGEXES)
+
+
+def is_interactive_pod(commands: list[str]) -> bool:
+    # containers are checked one by one, sidecars don't mask the main command
+    return any(is_interactive_command(command) for command in commands)
+
+
+def get_container_command(command, args) -> str:
+    return " ".join((command or []) + (args or []))
+
+
+def get_pod_commands(pod) -> list[str]:
+    return [
+        get_container_command(container.command, container.args)
+        for container in pod.spec.containers
+    ]
+
 
 def get_pods_info():
     cmd = "kubectl get pods -n informatics -o json"
@@ -26,7 +64,7 @@ def get_pods_command():
 
         total_cpu = 0
         total_gpu = 0
-        command = "None"
+        commands = []
 
         for container in containers:
             resources = container.get("resources", {})
@@ -38,12 +76,10 @@ def get_pods_command():
 
             total_cpu += int(cpu[:-1]) if "m" in cpu else int(cpu) * 1000
             total_gpu += int(gpu)
-            if "command" in container:
-                command = " ".join(container["command"])
-            if "args" in container:
-                command += " "
-                command += " ".join(container["args"])
-        pod_cmd.update({pod_name: command})
+            commands.append(
+                get_container_command(container.get("command"), container.get("args"))
+            )
+        pod_cmd.update({pod_name: commands})
         pod_runtime.update({pod_name: runtime_duration})
         pod_numgpus.update({pod_name: total_gpu})
     return pod_cmd, pod_runtime, pod_numgpus
@@ -53,11 +89,11 @@ def filter_while_true_pods():
     pod_cmd, pod_runtime, pod_numgpus = get_pods_command()
     while_true_pods = []
     for k, v in pod_cmd.items():
-        if "sleep infinity" in v or "while true" in v:
+        if is_interactive_pod(v):
             while_true_pods.append(
                 {
                     "name": k,
-                    "command": v,
+                    "command": "; ".join(command for command in v if command) or "None",
                     "runtime": pod_runtime[k],
                     "#GPUs": pod_numgpus[k],
                 }
@@ -132,9 +168,11 @@ def get_pods_not_using_gpus(namespace: str = "informatics") -> list[dict]:
     return res
 
 
-def get_gpu_usage_in_pod(pod_name, namespace="informatics") -> list[dict]:
+def get_gpu_usage_in_pod(
+    pod_name, namespace="informatics", api_client=None
+) -> list[dict]:
     # Create a Kubernetes API client
-    v1 = client.CoreV1Api()
+    v1 = client.CoreV1Api(api_client)
 
     # Command to get stats of each GPU
     gpu_mem_cmd = "nvidia-smi --query-gpu=gpu_name,memory.used,memory.free,memory.total,utilization.gpu,utilization.memory --format=csv,noheader,nounits"
@@ -185,6 +223,8 @@ def convert_cpu(cpu) -> int:
 def convert_memory(memory) -> int:
     if memory is None:
         return 0
+    if "Ki" in memory:
+        return int(memory.replace("Ki", "")) // (1024 * 1024)
     if "Mi" in memory:
         return int(memory.replace("Mi", "")) // 1024
     if "Gi" in memory or "G" in memory:
@@ -192,55 +232,82 @@ def convert_memory(memory) -> int:
     return int(memory)
 
 
-def get_pods_not_using_gpus_stats(namespace="informatics") -> list[dict]:
-    config.load_kube_config("/kubernetes/config")
-
+def list_gpu_pods(namespace="informatics", api_client=None) -> list:
     # Create a Kubernetes API client
-    v1 = client.CoreV1Api()
+    v1 = client.CoreV1Api(api_client)
 
     # List all running pods in the specified namespace
     ret = v1.list_namespaced_pod(namespace)
 
-    data = []
-    for pod in ret.items:
-        # check if the pod is running
-        if pod.status.phase != "Running":
-            continue
-        # check if the pod is using GPUs
-        if not any(
+    return [
+        pod
+        for pod in ret.items
+        # check if the pod is running and using GPUs
+        if pod.status.phase == "Running"
+        and any(
             "nvidia.com/gpu" in container.resources.limits
             for container in pod.spec.containers
-        ):
-            continue
-
-        pod_name = pod.metadata.name
-        username = pod.metadata.labels["eidf/user"].replace("-infk8s", "")
-        pod_id = pod.metadata.uid
-        gpu_usage = get_gpu_usage_in_pod(pod_name)
-        if len(gpu_usage) == 0:
-            continue
-        data.append(
-            {
-                "node_name": pod.spec.node_name,
-                "pod_name": pod_name,
-                "username": username,
-                "pod_id": pod_id,
-                "gpu_usage": gpu_usage,
-                "cpu_requested": convert_cpu(
-                    pod.spec.containers[0].resources.requests.get("cpu", None)
-                ),
-                "memory_requested": convert_memory(
-                    pod.spec.containers[0].resources.requests.get("memory", None)
-                ),
-            }
         )
+    ]
+
+
+def get_gpu_usage_in_pod_threaded(pod_name, namespace, configuration) -> list[dict]:
+    # to be run on an executor thread, with that thread's own client
+    return get_gpu_usage_in_pod(pod_name, namespace, get_exec_api_client(configuration))
+
+
+def get_pod_stats(pod, gpu_usage, known_interactive=None) -> dict | None:
+    if len(gpu_usage) == 0:
+        return None
+
+    # pods already classified, by uid, are not classified again
+    known_interactive = known_interactive or {}
+
+    pod_id = pod.metadata.uid
+    is_interactive = known_interactive.get(pod_id)
+    if is_interactive is None:
+        is_interactive = is_interactive_pod(get_pod_commands(pod))
+    start_time = pod.status.start_time
+    if start_time is not None:
+        start_time = start_time.astimezone().replace(tzinfo=None)
+        start_time = start_time.strftime("%Y-%m-%d %H:%M:%S")
+    return {
+        "node_name": pod.spec.node_name,
+        "pod_name": pod.metadata.name,
+        "username": pod.metadata.labels["eidf/user"].replace("-infk8s", ""),
+        "pod_id": pod_id,
+        "start_time": start_time,
+        "is_interactive": is_interactive,
+        "gpu_usage": gpu_usage,
+        "cpu_requested": convert_cpu(
+            pod.spec.containers[0].resources.requests.get("cpu", None)
+        ),
+        "memory_requested": convert_memory(
+            pod.spec.containers[0].resources.requests.get("memory", None)
+        ),
+    }
+
+
+def get_pods_not_using_gpus_stats(
+    namespace="informatics", api_client=None, known_interactive=None
+) -> list[dict]:
+    if api_client is None:
+        config.load_kube_config("/kubernetes/config")
+
+    data = []
+    for pod in list_gpu_pods(namespace, api_client):
+        gpu_usage = get_gpu_usage_in_pod(pod.metadata.name, namespace, api_client)
+        entry = get_pod_stats(pod, gpu_usage, known_interactive)
+        if entry is not None:
+            data.append(entry)
     return data
 
 
-def get_pending_pods(namespace="informatics") -> list[str]:
-    config.load_kube_config("/kubernetes/config")
+def get_pending_pods(namespace="informatics", api_client=None) -> list[str]:
+    if api_client is None:
+        config.load_kube_config("/kubernetes/config")
     # Create a Kubernetes API client
-    v1 = client.CoreV1Api()
+    v1 = client.CoreV1Api(api_client)
 
     # List all running pods in the specified namespace
     ret = v1.list_namespaced_pod(namespace)
@@ -252,3 +319,23 @@ def get_pending_pods(namespace="informatics") -> list[str]:
             data.append(pod.metadata.name)
 
     return data
+
+
+def get_nodes_allocatable(api_client=None) -> list[dict]:
+    if api_client is None:
+        config.load_kube_config("/kubernetes/config")
+    # Create a Kubernetes API client
+    v1 = client.CoreV1Api(api_client)
+
+    data = []
+    for node in v1.list_node().items:
+        allocatable = node.status.allocatable or {}
+        data.append(
+            {
+                "node_name": node.metadata.name,
+                "cpu": convert_cpu(allocatable.get("cpu", None)),
+                "memory": convert_memory(allocatable.get("memory", None)),
+                "gpu": int(allocatable.get("nvidia.com/gpu", 0)),
+            }
+        )
+    return data